@@ -15,6 +15,7 @@ setup(
     package_dir = {"maflib" : "src/maflib", "maftools" : "src/maftools"},
     package_data = {'maflib': ['resources/*.json']},
     install_requires = [],
+    extras_require = {"numba": ["numpy", "numba"]},
     classifiers = [
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
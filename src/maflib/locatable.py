@@ -4,6 +4,8 @@
 class Locatable(object):
     """A class that defines a genomic location (or span)."""
 
+    __slots__ = ("_chromosome", "_start", "_end")
+
     def __init__(self, chromosome, start, end):
         self._chromosome = chromosome
         self._start = start
@@ -44,6 +46,8 @@ class LocatableByAllele(Locatable):
     """A class that defines a genomic location (or span), with an associated
     reference and set of alternate alleles (may be empty)"""
 
+    __slots__ = ("_ref", "_alts")
+
     def __init__(self, chromosome, start, end, ref, alts):
         self._ref = ref
         self._alts = alts
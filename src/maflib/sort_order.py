@@ -7,12 +7,117 @@ from maflib.util import abstractclassmethod
 from maflib.locatable import Locatable
 
 
+# The number of bits used for each of the start and end positions when packing
+# a coordinate into a single integer.  The contig index occupies the remaining
+# high-order bits.
+_POSITION_BITS = 32
+_POSITION_MAX = (1 << _POSITION_BITS) - 1
+
+
+def _pack_coordinate(contig, start, end):
+    """Packs the contig index, start position, and end position into a single
+    integer whose natural ordering is the (contig, start, end) ordering.
+    Returns None if the contig is not an index (i.e. no contigs were given) or
+    the positions are not integers in the range that can be packed, in which
+    case the fields are compared as a tuple."""
+    if not isinstance(contig, int) or not isinstance(start, int) \
+            or not isinstance(end, int) \
+            or not 0 <= start <= _POSITION_MAX \
+            or not 0 <= end <= _POSITION_MAX:
+        return None
+    return (contig << (2 * _POSITION_BITS)) | (start << _POSITION_BITS) | end
+
+
+def _nones_last(value):
+    """Returns a pair for the value that orders a None value after all other
+    values, as SortOrderKey.compare does."""
+    return value is None, value
+
+
+def _coordinate_columns(records, contig_idx):
+    """Returns NumPy arrays of the contig indices, start positions, and end
+    positions of the given records, or None if a record is not a Locatable,
+    is not on one of the given contigs, or its positions cannot be packed
+    (see _pack_coordinate).  Also returns None if NumPy is not installed."""
+    np = _numpy()
+    if np is None:
+        return None
+    if not all(issubclass(r.__class__, Locatable) for r in records):
+        return None
+    try:
+        chroms = [contig_idx[r.chromosome] for r in records]
+        starts = [r.start for r in records]
+        ends = [r.end for r in records]
+    except (AttributeError, KeyError):
+        # let the record-at-a-time path report the problem
+        return None
+    chroms = np.array(chroms, dtype=np.int64)
+    starts = np.array(starts)
+    ends = np.array(ends)
+    for positions in [starts, ends]:
+        if positions.dtype.kind != "i" or positions.min() < 0 \
+                or positions.max() > _POSITION_MAX:
+            return None
+    return chroms, starts, ends
+
+
+def _first_out_of_order(chroms, starts, ends):
+    """Returns the index of the first coordinate that is less than the one
+    preceding it, or -1 if the coordinates are in order.  See
+    _compiled_first_out_of_order for the compiled version."""
+    for i in range(1, len(chroms)):
+        if chroms[i] != chroms[i - 1]:
+            if chroms[i] < chroms[i - 1]:
+                return i
+        elif starts[i] != starts[i - 1]:
+            if starts[i] < starts[i - 1]:
+                return i
+        elif ends[i] < ends[i - 1]:
+            return i
+    return -1
+
+
+# NumPy and numba are optional, and are imported on first use since importing
+# numba is slow.  None if not yet imported, False if not installed.
+_NUMPY = None
+_FIRST_OUT_OF_ORDER_COMPILED = None
+
+
+def _numpy():
+    """Returns the numpy module, or None if it is not installed."""
+    global _NUMPY
+    if _NUMPY is None:
+        try:
+            import numpy
+            _NUMPY = numpy
+        except ImportError:
+            _NUMPY = False
+    return _NUMPY or None
+
+
+def _compiled_first_out_of_order():
+    """Returns _first_out_of_order compiled with numba, or None if numba is
+    not installed."""
+    global _FIRST_OUT_OF_ORDER_COMPILED
+    if _FIRST_OUT_OF_ORDER_COMPILED is None:
+        try:
+            import numba
+            _FIRST_OUT_OF_ORDER_COMPILED = \
+                numba.njit(cache=True)(_first_out_of_order)
+        except ImportError:
+            _FIRST_OUT_OF_ORDER_COMPILED = False
+    return _FIRST_OUT_OF_ORDER_COMPILED or None
+
+
 class SortOrder(object):
     """Base class for all sort orders.  Sub-classes should implement name and
     sortKey."""
 
     __metaclass__ = abc.ABCMeta
 
+    # The known sort order classes by name, built on the first call to find
+    _BY_NAME = None
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -29,25 +134,25 @@ class SortOrder(object):
     @classmethod
     def all(cls):
         """Returns the known sort order classes."""
-        return [
-            Unknown,
-            Unsorted,
-            BarcodesAndCoordinate,
-            Coordinate
-        ]
+        return _ALL_SORT_ORDERS
 
     @classmethod
     def find(cls, sort_order_name):
         """Returns the sort order class by name.  Throws an exception if
         none was found"""
-        sort_order = next(iter([so for so in SortOrder.all()
-                                if so.name() == sort_order_name]), None)
+        if SortOrder._BY_NAME is None:
+            SortOrder._BY_NAME = dict((so.name(), so) for so in SortOrder.all())
+        sort_order = SortOrder._BY_NAME.get(sort_order_name)
         if not sort_order:
             sort_orders = ", ".join([s.name() for s in SortOrder.all()])
             raise ValueError("Could not find sort order '%s', options: %s"
                              % (sort_order_name, sort_orders))
         return sort_order
 
+    def sort_records(self, records):
+        """Returns the given records sorted into this ordering."""
+        return sorted(records, key=self.sort_key())
+
     def __str__(self):
         return self.name()
 
@@ -55,10 +160,13 @@ class SortOrder(object):
 @total_ordering
 class SortOrderKey(object):
     """A container for the key used to sort MafRecords.  Sub-classes should
-    implement the __cmp__ method."""
+    either implement the __lt__ and __eq__ methods directly, or implement the
+    __cmp__ method."""
 
     __metaclass__ = abc.ABCMeta
 
+    __slots__ = ()
+
     def __lt__(self, other):
         """Compare less than"""
         return self.__cmp__(other) < 0
@@ -76,14 +184,9 @@ class SortOrderKey(object):
     def compare(cls, this, that):
         """Convenience method for comparing two objects of the same type that
         have a total ordering."""
-        if this is None and that is None:
-            return 0
-        elif this is None:
-            return 1
-        elif that is None:
-            return -1
-        else:
-            return (this > that) - (this < that)
+        return 0 if this is that else (
+            1 if this is None else (
+                -1 if that is None else (this > that) - (this < that)))
 
 
 class Unknown(SortOrder):
@@ -125,28 +228,82 @@ class _CoordinateKey(SortOrderKey, Locatable):
     """A little class that aids in comparing records based on chromosome, 
     start position, and end position"""
 
-    def __init__(self, record, contigs):
+    __slots__ = ("_key", "_fields")
+
+    def __init__(self, record, contig_idx, contigs=None):
         if not issubclass(record.__class__, Locatable):
             raise ValueError("Record of type '%s' is not a subclass of "
                              "'Locatable'" % record.__class__.__name__)
         chromosome = record.chromosome
-        if contigs:
+        if contig_idx:
             try:
-                chromosome = contigs.index(chromosome)
-            except ValueError:
+                chromosome = contig_idx[chromosome]
+            except KeyError:
                 raise ValueError(
                     "Could not find contig '%s' in list of contigs: %s"
-                    % (chromosome, ", ".join(contigs))
+                    % (chromosome, ", ".join(contigs or contig_idx))
                 )
-        Locatable.__init__(self, chromosome, record.start, record.end)
+        self._chromosome = chromosome
+        self._start = record.start
+        self._end = record.end
+        self._update_key()
+
+    def _build_key(self):
+        """Builds the value used for fast comparisons, namely the packed
+        coordinate, or None if the coordinate cannot be packed."""
+        return _pack_coordinate(self.chromosome, self.start, self.end)
+
+    def _build_fields(self):
+        """Builds the tuple of fields compared when either key cannot be
+        compared by its packed value.  None values sort last."""
+        return (_nones_last(self.chromosome), _nones_last(self.start),
+                _nones_last(self.end))
+
+    def _update_key(self):
+        """Rebuilds the comparison values.  The fields are built lazily if the
+        coordinate could be packed."""
+        self._key = self._build_key()
+        self._fields = None if self._key is not None else self._build_fields()
+
+    def _compare_fields(self):
+        """Returns the tuple of fields used for comparisons."""
+        if self._fields is None:
+            self._fields = self._build_fields()
+        return self._fields
+
+    @Locatable.chromosome.setter
+    def chromosome(self, value):
+        """Sets the chromosome, keeping the comparison key in sync"""
+        self._chromosome = value
+        self._update_key()
+
+    @Locatable.start.setter
+    def start(self, value):
+        """Sets the start position, keeping the comparison key in sync"""
+        self._start = value
+        self._update_key()
+
+    @Locatable.end.setter
+    def end(self, value):
+        """Sets the end position, keeping the comparison key in sync"""
+        self._end = value
+        self._update_key()
+
+    def __lt__(self, other):
+        if self._key is not None and other._key is not None:
+            return self._key < other._key
+        return self._compare_fields() < other._compare_fields()
+
+    def __eq__(self, other):
+        if self._key is not None and other._key is not None:
+            return self._key == other._key
+        return self._compare_fields() == other._compare_fields()
+
+    def __hash__(self):
+        return hash(self._compare_fields())
 
     def __cmp__(self, other):
-        diff = self.compare(self.chromosome, other.chromosome)
-        if diff == 0:
-            diff = self.compare(self.start, other.start)
-        if diff == 0:
-            diff = self.compare(self.end, other.end)
-        return diff
+        return (other < self) - (self < other)
 
     def __str__(self):
         return "\t".join(
@@ -167,14 +324,19 @@ class Coordinate(SortOrder):
         """
         self._contigs = None
         if fasta_index:
-            handle = open(fasta_index, "r")
-            self._contigs = \
-                [line.rstrip("\r\n").split("\t")[0] for line in handle]
-            handle.close()
+            with open(fasta_index, "r") as handle:
+                self._contigs = [line.split("\t", 1)[0]
+                                 for line in handle.read().splitlines()]
         elif contigs:
             assert isinstance(contigs, list), \
                 "contigs must be a list, but {0} found".format(type(contigs))
             self._contigs = contigs[:]
+        self._contig_idx = None
+        if self._contigs:
+            # a duplicated contig is ordered by its first occurrence
+            self._contig_idx = dict()
+            for i, name in enumerate(self._contigs):
+                self._contig_idx.setdefault(name, i)
         super(Coordinate, self).__init__(*args, **kwargs)
 
     @classmethod
@@ -187,25 +349,78 @@ class Coordinate(SortOrder):
         ordering"""
         def key(record):
             """Gets the key"""
-            return _CoordinateKey(record=record, contigs=self._contigs)
+            return _CoordinateKey(record=record, contig_idx=self._contig_idx,
+                                  contigs=self._contigs)
         return key
 
+    def sort_records(self, records):
+        """Returns the given records sorted into this ordering.  When NumPy is
+        available, the contigs are known, and the order is by coordinate
+        alone, the records are sorted with a stable NumPy sort over their
+        contig indices, start, and end positions, so records with equal
+        coordinates keep their order."""
+        records = list(records)
+        if type(self) is Coordinate and self._contig_idx and records \
+                and _numpy():
+            columns = _coordinate_columns(records, self._contig_idx)
+            if columns is not None:
+                chroms, starts, ends = columns
+                order = _numpy().lexsort((ends, starts, chroms))
+                return [records[i] for i in order]
+        return super(Coordinate, self).sort_records(records)
+
 
 class _BarcodesAndCoordinateKey(_CoordinateKey):
     """A little class that aids in comparing records based on tumor barcode,
     matched normal barcode, chromosome, start position, and end position"""
-    def __init__(self, record, contigs):
-        self.tumor_barcode = record.value("Tumor_Sample_Barcode")
-        self.normal_barcode = record.value("Matched_Norm_Sample_Barcode")
-        super(_BarcodesAndCoordinateKey, self).__init__(record, contigs)
 
-    def __cmp__(self, other):
-        diff = self.compare(self.tumor_barcode, other.tumor_barcode)
-        if diff == 0:
-            diff = self.compare(self.normal_barcode, other.normal_barcode)
-        if diff == 0:
-            diff = super(_BarcodesAndCoordinateKey, self).__cmp__(other)
-        return diff
+    __slots__ = ("_tumor_barcode", "_normal_barcode")
+
+    def __init__(self, record, contig_idx, contigs=None):
+        self._tumor_barcode = record.value("Tumor_Sample_Barcode")
+        self._normal_barcode = record.value("Matched_Norm_Sample_Barcode")
+        super(_BarcodesAndCoordinateKey, self).__init__(record, contig_idx,
+                                                        contigs)
+
+    @property
+    def tumor_barcode(self):
+        """Returns the tumor barcode"""
+        return self._tumor_barcode
+
+    @tumor_barcode.setter
+    def tumor_barcode(self, value):
+        """Sets the tumor barcode, keeping the comparison key in sync"""
+        self._tumor_barcode = value
+        self._update_key()
+
+    @property
+    def normal_barcode(self):
+        """Returns the matched normal barcode"""
+        return self._normal_barcode
+
+    @normal_barcode.setter
+    def normal_barcode(self, value):
+        """Sets the matched normal barcode, keeping the comparison key in
+        sync"""
+        self._normal_barcode = value
+        self._update_key()
+
+    def _build_key(self):
+        """Builds the value used for fast comparisons, namely a tuple of the
+        tumor barcode, normal barcode, and packed coordinate, or None if the
+        coordinate cannot be packed."""
+        packed = super(_BarcodesAndCoordinateKey, self)._build_key()
+        if packed is None:
+            return None
+        return (_nones_last(self.tumor_barcode),
+                _nones_last(self.normal_barcode), packed)
+
+    def _build_fields(self):
+        """Builds the tuple of fields compared when either key cannot be
+        compared by its packed value.  None values sort last."""
+        return ((_nones_last(self.tumor_barcode),
+                 _nones_last(self.normal_barcode)) +
+                super(_BarcodesAndCoordinateKey, self)._build_fields())
 
     def __str__(self):
         return "\t".join([self.tumor_barcode, self.normal_barcode,
@@ -230,15 +445,27 @@ class BarcodesAndCoordinate(Coordinate):
         def key(record):
             """Gets the key"""
             return _BarcodesAndCoordinateKey(record=record,
+                                             contig_idx=self._contig_idx,
                                              contigs=self._contigs)
         return key
 
 
+# The known sort order classes, returned by SortOrder.all()
+_ALL_SORT_ORDERS = (
+    Unknown,
+    Unsorted,
+    BarcodesAndCoordinate,
+    Coordinate
+)
+
+
 class SortOrderChecker(object):
     """Checks that the records given are in sorted order"""
 
     def __init__(self, sort_order):
         self._last_rec = None
+        self._last_key = None
+        self._sort_order = sort_order
         try:
             self._sort_f = sort_order.sort_key()
         except NotImplementedError:
@@ -247,30 +474,74 @@ class SortOrderChecker(object):
 
     def add(self, rec):
         """Check that the given record is in order relative to the previous
-        record"""
+        record.  The sort key is built for every record, including the first,
+        so a record that has no valid key (e.g. it is on an unknown contig)
+        raises a ValueError even if it is the first record."""
         return self.__iadd__(rec)
 
+    def add_batch(self, records):
+        """Check that the given records are in order relative to each other
+        and to the previous record.  When numba is available and the records
+        are ordered by coordinate across known contigs, the check is done in
+        a single compiled pass.  If a record is out of order, the checker is
+        left at the record preceding it, as when adding records one at a
+        time."""
+        records = list(records)
+        if not records or not self._add_batch_compiled(records):
+            for rec in records:
+                self.__iadd__(rec)
+        return self
+
+    def _add_batch_compiled(self, records):
+        """Checks the records using the compiled check, returning False if
+        the check is not applicable so the caller may fall back to checking
+        the records one at a time."""
+        if not self._sort_f or type(self._sort_order) is not Coordinate \
+                or not self._sort_order._contig_idx:
+            return False
+        first_out_of_order = _compiled_first_out_of_order()
+        if first_out_of_order is None:
+            return False
+        to_check = records if self._last_rec is None \
+            else [self._last_rec] + records
+        columns = _coordinate_columns(to_check, self._sort_order._contig_idx)
+        if columns is None:
+            # let the record-at-a-time check report the problem
+            return False
+        i = first_out_of_order(*columns)
+        if i >= 0:
+            self._last_rec = to_check[i - 1]
+            self._last_key = self._sort_f(self._last_rec)
+            raise ValueError("Records out of order\n%s\n%s" %
+                             (str(to_check[i - 1]), str(to_check[i])))
+        self._last_rec = records[-1]
+        self._last_key = self._sort_f(self._last_rec)
+        return True
+
     def __iadd__(self, rec):
-        if self._last_rec and self._sort_f:
+        if self._sort_f:
             rec_key = self._sort_f(rec)
-            last_rec_key = self._sort_f(self._last_rec)
-            if rec_key < last_rec_key:
+            if self._last_key is not None and rec_key < self._last_key:
                 raise ValueError("Records out of order\n%s\n%s" %
                                  (str(self._last_rec), str(rec)))
+            self._last_key = rec_key
         self._last_rec = rec
         return self
 
-    def __del__(self):
-        self._last_rec = None
-        self._sort_f = None
-
 
 class SortOrderEnforcingIterator(object):
-    """An iterator that enforces a sort order."""
+    """An iterator that enforces a sort order.  As with SortOrderChecker, a
+    record without a valid sort key raises a ValueError, even if it is the
+    first record."""
 
     def __init__(self, _iter, sort_order):
-        self._checker = SortOrderChecker(sort_order=sort_order)
         self._iter = _iter
+        self._last_rec = None
+        self._last_key = None
+        try:
+            self._sort_f = sort_order.sort_key()
+        except NotImplementedError:
+            self._sort_f = None
 
     def __iter__(self):
         return self
@@ -281,5 +552,11 @@ class SortOrderEnforcingIterator(object):
 
     def __next__(self):
         rec = next(self._iter)
-        self._checker.add(rec)
+        if self._sort_f:
+            rec_key = self._sort_f(rec)
+            if self._last_key is not None and rec_key < self._last_key:
+                raise ValueError("Records out of order\n%s\n%s" %
+                                 (str(self._last_rec), str(rec)))
+            self._last_key = rec_key
+            self._last_rec = rec
         return rec
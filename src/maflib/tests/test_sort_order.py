@@ -2,6 +2,7 @@ import os
 import unittest
 
 from maflib.sort_order import *
+from maflib.sort_order import _compiled_first_out_of_order, _numpy
 from maflib.tests.testutils import tmp_file
 from maflib.locatable import Locatable
 
@@ -134,10 +135,56 @@ class TestBarcodeAndCoordinateKey(unittest.TestCase):
         fd.close()
         os.remove(fn)
 
+    def test_update_barcodes(self):
+        for contigs in [None, ["C"]]:
+            sort_key = BarcodesAndCoordinate(contigs=contigs).sort_key()
+            r1 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "C", 1, 2)
+            r2 = TestBarcodeAndCoordinateKey.DummyRecord("B", "B", "C", 1, 2)
+
+            k1, k2 = sort_key(r1), sort_key(r2)
+            k1.tumor_barcode = "C"
+            self.assertEqual(k1.tumor_barcode, "C")
+            self.assertGreater(k1, k2)
+
+            k1, k2 = sort_key(r1), sort_key(r1)
+            k1.normal_barcode = "C"
+            self.assertEqual(k1.normal_barcode, "C")
+            self.assertGreater(k1, k2)
+
+    def test_none_barcodes(self):
+        for contigs in [None, ["C"]]:
+            sort_key = BarcodesAndCoordinate(contigs=contigs).sort_key()
+            r1 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "C", 1, 2)
+            r2 = TestBarcodeAndCoordinateKey.DummyRecord("A", None, "C", 1, 2)
+            r3 = TestBarcodeAndCoordinateKey.DummyRecord(None, "B", "C", 1, 2)
+            r4 = TestBarcodeAndCoordinateKey.DummyRecord(None, None, "C", 1, 2)
+            self.__test_diff(r1, r2, sort_key=sort_key)
+            self.__test_diff(r2, r3, sort_key=sort_key)
+            self.__test_diff(r3, r4, sort_key=sort_key)
+
+    def test_none_positions(self):
+        for contigs in [None, ["C"]]:
+            sort_key = BarcodesAndCoordinate(contigs=contigs).sort_key()
+            r1 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "C", 1, 2)
+            r2 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "C", 1,
+                                                         None)
+            r3 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "C", None,
+                                                         1)
+            r4 = TestBarcodeAndCoordinateKey.DummyRecord("B", "B", "C", 1, 1)
+            self.__test_diff(r1, r2, sort_key=sort_key)
+            self.__test_diff(r2, r3, sort_key=sort_key)
+            self.__test_diff(r3, r4, sort_key=sort_key)
+
     def test_str(self):
         self.assertEqual(BarcodesAndCoordinate.name(),
                          str(BarcodesAndCoordinate()))
 
+    def test_sort_records(self):
+        r1 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "chr2", 1, 2)
+        r2 = TestBarcodeAndCoordinateKey.DummyRecord("B", "B", "chr1", 1, 2)
+        sort_order = BarcodesAndCoordinate(contigs=["chr1", "chr2"])
+        self.assertListEqual(sort_order.sort_records([r2, r1]), [r1, r2])
+
     def test_key_str(self):
         r1 = TestBarcodeAndCoordinateKey.DummyRecord("A", "B", "C", 1, 2)
         sort_key = BarcodesAndCoordinate().sort_key()
@@ -221,12 +268,142 @@ class TestCoordinateKey(unittest.TestCase):
         fd.close()
         os.remove(fn)
 
+    def test_packed_with_contigs(self):
+        sort_key = Coordinate(contigs=["chr1", "chr2"]).sort_key()
+
+        r1 = TestCoordinateKey.DummyRecord("chr1", 2, 2**31)
+        r2 = TestCoordinateKey.DummyRecord("chr1", 3, 3)
+        r3 = TestCoordinateKey.DummyRecord("chr2", 1, 1)
+        self.__test_diff(r1, r2, sort_key=sort_key)
+        self.__test_diff(r2, r3, sort_key=sort_key)
+
+    def test_duplicate_contigs(self):
+        sort_order = Coordinate(contigs=["chr1", "chr2", "chr1"])
+        sort_key = sort_order.sort_key()
+
+        # the first occurrence of a contig defines its order
+        r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        r2 = TestCoordinateKey.DummyRecord("chr2", 1, 2)
+        self.__test_diff(r1, r2, sort_key=sort_key)
+        self.assertListEqual(sort_order.sort_records([r2, r1]), [r1, r2])
+
+        # the error lists the contigs as given
+        with self.assertRaises(ValueError) as context:
+            sort_key(TestCoordinateKey.DummyRecord("no-chr", 1, 2))
+        self.assertEqual(str(context.exception),
+                         "Could not find contig 'no-chr' in list of contigs: "
+                         "chr1, chr2, chr1")
+
+    def test_unpackable_with_contigs(self):
+        sort_key = Coordinate(contigs=["chr1", "chr2"]).sort_key()
+
+        # positions that do not fit in the packed key are still ordered
+        r1 = TestCoordinateKey.DummyRecord("chr1", -1, 2)
+        r2 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        r3 = TestCoordinateKey.DummyRecord("chr1", 1, 2**32)
+        r4 = TestCoordinateKey.DummyRecord("chr2", 2**32, 1)
+        r5 = TestCoordinateKey.DummyRecord("chr2", 2**32 + 1, 1)
+        self.__test_diff(r1, r2, sort_key=sort_key)
+        self.__test_diff(r2, r3, sort_key=sort_key)
+        self.__test_diff(r3, r4, sort_key=sort_key)
+        self.__test_diff(r4, r5, sort_key=sort_key)
+
+    def test_none_positions(self):
+        for contigs in [None, ["C", "D"]]:
+            sort_key = Coordinate(contigs=contigs).sort_key()
+            r1 = TestCoordinateKey.DummyRecord("C", 1, 2)
+            r2 = TestCoordinateKey.DummyRecord("C", 1, None)
+            r3 = TestCoordinateKey.DummyRecord("C", None, 1)
+            r4 = TestCoordinateKey.DummyRecord("C", None, None)
+            r5 = TestCoordinateKey.DummyRecord("D", 1, 1)
+            self.__test_diff(r1, r2, sort_key=sort_key)
+            self.__test_diff(r2, r3, sort_key=sort_key)
+            self.__test_diff(r3, r4, sort_key=sort_key)
+            self.__test_diff(r4, r5, sort_key=sort_key)
+
+            records = [r5, r4, r3, r2, r1]
+            records.sort(key=sort_key)
+            self.assertEqual(records, [r1, r2, r3, r4, r5])
+
+    def test_hash(self):
+        sort_key = Coordinate().sort_key()
+        k1 = sort_key(TestCoordinateKey.DummyRecord("C", 1, 2))
+        k2 = sort_key(TestCoordinateKey.DummyRecord("C", 1, 2))
+        k3 = sort_key(TestCoordinateKey.DummyRecord("C", 1, 3))
+        self.assertEqual(len(set([k1, k2, k3])), 2)
+
+    def test_update_chromosome(self):
+        for contigs, chromosome in [(None, "D"), (["C", "D"], 1)]:
+            sort_key = Coordinate(contigs=contigs).sort_key()
+            k1 = sort_key(TestCoordinateKey.DummyRecord("C", 2, 2))
+            k2 = sort_key(TestCoordinateKey.DummyRecord("C", 3, 3))
+            self.assertLess(k1, k2)
+            k1.chromosome = chromosome
+            self.assertGreater(k1, k2)
+
+    def test_update_start(self):
+        for contigs in [None, ["C"]]:
+            sort_key = Coordinate(contigs=contigs).sort_key()
+            k1 = sort_key(TestCoordinateKey.DummyRecord("C", 1, 2))
+            k2 = sort_key(TestCoordinateKey.DummyRecord("C", 2, 2))
+            self.assertLess(k1, k2)
+            k1.start = 10
+            self.assertGreater(k1, k2)
+
+    def test_update_end(self):
+        for contigs in [None, ["C"]]:
+            sort_key = Coordinate(contigs=contigs).sort_key()
+            k1 = sort_key(TestCoordinateKey.DummyRecord("C", 1, 2))
+            k2 = sort_key(TestCoordinateKey.DummyRecord("C", 1, 3))
+            self.assertLess(k1, k2)
+            k1.end = 4
+            self.assertGreater(k1, k2)
+
     def test_key_str(self):
         r1 = TestCoordinateKey.DummyRecord("C", 1, 2)
         sort_key = Coordinate().sort_key()
         self.assertEqual(str(sort_key(r1)), "C\t1\t2")
 
 
+    def test_sort_records(self):
+        r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        r2 = TestCoordinateKey.DummyRecord("chr1", 2, 3)
+        r3 = TestCoordinateKey.DummyRecord("chr1", 2, 3)
+        r4 = TestCoordinateKey.DummyRecord("chr2", 1, 1)
+
+        sort_order = Coordinate(contigs=["chr1", "chr2"])
+        records = sort_order.sort_records([r4, r2, r1, r3])
+        self.assertEqual(len(records), 4)
+        self.assertIs(records[0], r1)
+        # ties keep their original order
+        self.assertIs(records[1], r2)
+        self.assertIs(records[2], r3)
+        self.assertIs(records[3], r4)
+
+        self.assertListEqual(sort_order.sort_records([]), [])
+        self.assertListEqual(Coordinate().sort_records([r2, r1]), [r1, r2])
+
+        # contig undefined
+        with self.assertRaises(ValueError):
+            sort_order.sort_records(
+                [r1, TestCoordinateKey.DummyRecord("no-chr", 1, 3)])
+
+        with self.assertRaises(NotImplementedError):
+            Unsorted().sort_records([r2, r1])
+
+    @unittest.skipUnless(_numpy(), "numpy not installed")
+    def test_sort_records_numpy(self):
+        contigs = ["chr1", "chr2", "chr3"]
+        records = [TestCoordinateKey.DummyRecord(contigs[(i * 7) % 3],
+                                                 (i * 13) % 5, (i * 11) % 4)
+                   for i in range(50)]
+        sort_order = Coordinate(contigs=contigs)
+        expected = sorted(records, key=sort_order.sort_key())
+        actual = sort_order.sort_records(records)
+        self.assertEqual(len(actual), len(expected))
+        for a, e in zip(actual, expected):
+            self.assertIs(a, e)
+
     def test_not_locatable(self):
         sort_key = Coordinate().sort_key()
 
@@ -237,6 +414,162 @@ class TestCoordinateKey(unittest.TestCase):
             sort_key(Coordinate())
 
 
+class TestSortOrderChecker(unittest.TestCase):
+    def test_add_batch_ok(self):
+        r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        r2 = TestCoordinateKey.DummyRecord("chr1", 2, 3)
+        r3 = TestCoordinateKey.DummyRecord("chr2", 1, 1)
+
+        checker = SortOrderChecker(Coordinate(contigs=["chr1", "chr2"]))
+        self.assertIs(checker.add_batch([r1, r2]), checker)
+        self.assertIs(checker.add_batch([]), checker)
+        self.assertIs(checker.add_batch(iter([r3])), checker)
+
+        # the last record is remembered across batches
+        with self.assertRaises(ValueError):
+            checker.add(r2)
+
+    def test_add_batch_fail(self):
+        r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        r2 = TestCoordinateKey.DummyRecord("chr1", 1, 3)
+        r3 = TestCoordinateKey.DummyRecord("chr2", 1, 1)
+        sort_order = Coordinate(contigs=["chr1", "chr2"])
+
+        with self.assertRaises(ValueError):
+            SortOrderChecker(sort_order).add_batch([r2, r1])
+
+        # out of order relative to the previous batch
+        checker = SortOrderChecker(sort_order)
+        checker.add_batch([r1, r3])
+        with self.assertRaises(ValueError):
+            checker.add_batch([r2])
+
+        # contig undefined
+        with self.assertRaises(ValueError):
+            SortOrderChecker(sort_order).add_batch(
+                [r1, TestCoordinateKey.DummyRecord("no-chr", 1, 3)])
+
+    def test_add_first_record_invalid(self):
+        # the first record's key is built, so an invalid first record raises
+        sort_order = Coordinate(contigs=["chr1"])
+        with self.assertRaises(ValueError):
+            SortOrderChecker(sort_order).add(
+                TestCoordinateKey.DummyRecord("no-chr", 1, 1))
+        with self.assertRaises(ValueError):
+            SortOrderChecker(sort_order).add(Coordinate())
+        with self.assertRaises(ValueError):
+            SortOrderChecker(sort_order).add_batch(
+                [TestCoordinateKey.DummyRecord("no-chr", 1, 1)])
+
+        # no key is built when the order cannot be sorted
+        SortOrderChecker(Unsorted()).add(Coordinate())
+
+    def test_add_batch_fail_state(self):
+        r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        r2 = TestCoordinateKey.DummyRecord("chr1", 5, 6)
+        r3 = TestCoordinateKey.DummyRecord("chr1", 2, 3)
+        r4 = TestCoordinateKey.DummyRecord("chr1", 5, 7)
+        sort_order = Coordinate(contigs=["chr1"])
+
+        # the checker is left at the record preceding the one out of order,
+        # whether checking records in a batch or one at a time
+        for add in [lambda c, recs: c.add_batch(recs),
+                    lambda c, recs: [c.add(rec) for rec in recs]]:
+            checker = SortOrderChecker(sort_order)
+            with self.assertRaises(ValueError):
+                add(checker, [r1, r2, r3])
+            with self.assertRaises(ValueError):
+                checker.add(r3)
+            checker.add(r4)
+
+    def test_add_batch_not_locatable(self):
+        class NotLocatable(object):
+            chromosome = "chr1"
+            start = 1
+            end = 2
+
+        r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        checker = SortOrderChecker(Coordinate(contigs=["chr1"]))
+        with self.assertRaises(ValueError):
+            checker.add_batch([r1, NotLocatable()])
+
+    def test_add_batch_unsorted(self):
+        r1 = TestCoordinateKey.DummyRecord("C", 3, 4)
+        r2 = TestCoordinateKey.DummyRecord("C", 2, 3)
+        SortOrderChecker(Unsorted()).add_batch([r1, r2])
+
+
+@unittest.skipUnless(_compiled_first_out_of_order(), "numba not installed")
+class TestSortOrderCheckerCompiled(unittest.TestCase):
+
+    class EmptyRecord(Locatable):
+        """A locatable that is falsy, like an empty MafRecord"""
+        def __len__(self):
+            return 0
+
+    def setUp(self):
+        self.sort_order = Coordinate(contigs=["chr1", "chr2"])
+        self.r1 = TestCoordinateKey.DummyRecord("chr1", 1, 2)
+        self.r2 = TestCoordinateKey.DummyRecord("chr1", 1, 3)
+        self.r3 = TestCoordinateKey.DummyRecord("chr2", 1, 1)
+
+    def test_compiled_ok(self):
+        checker = SortOrderChecker(self.sort_order)
+        self.assertTrue(checker._add_batch_compiled([self.r1, self.r2]))
+        self.assertTrue(checker._add_batch_compiled([self.r3]))
+        with self.assertRaises(ValueError):
+            checker.add(self.r2)
+
+    def test_compiled_fail(self):
+        checker = SortOrderChecker(self.sort_order)
+        with self.assertRaises(ValueError) as context:
+            checker._add_batch_compiled([self.r1, self.r3, self.r2])
+        self.assertEqual(str(context.exception),
+                         "Records out of order\n%s\n%s"
+                         % (str(self.r3), str(self.r2)))
+
+    def test_compiled_fail_previous_batch(self):
+        checker = SortOrderChecker(self.sort_order)
+        checker.add_batch([self.r2])
+        with self.assertRaises(ValueError) as context:
+            checker._add_batch_compiled([self.r1])
+        self.assertEqual(str(context.exception),
+                         "Records out of order\n%s\n%s"
+                         % (str(self.r2), str(self.r1)))
+
+    def test_compiled_fail_state(self):
+        r4 = TestCoordinateKey.DummyRecord("chr2", 2, 2)
+        checker = SortOrderChecker(self.sort_order)
+        with self.assertRaises(ValueError):
+            checker._add_batch_compiled([self.r1, self.r3, self.r2])
+        # left at the record preceding the one out of order
+        with self.assertRaises(ValueError):
+            checker.add(self.r2)
+        checker.add(r4)
+
+    def test_compiled_falsy_previous_record(self):
+        checker = SortOrderChecker(self.sort_order)
+        checker.add(TestSortOrderCheckerCompiled.EmptyRecord("chr2", 5, 5))
+        with self.assertRaises(ValueError):
+            checker._add_batch_compiled([self.r1])
+
+    def test_compiled_not_applicable(self):
+        # the barcode key is not supported by the compiled check
+        checker = SortOrderChecker(BarcodesAndCoordinate(contigs=["chr1"]))
+        self.assertFalse(checker._add_batch_compiled([self.r1]))
+
+        # the contigs are not known
+        checker = SortOrderChecker(Coordinate())
+        self.assertFalse(checker._add_batch_compiled([self.r1]))
+
+        # positions that cannot be packed
+        checker = SortOrderChecker(self.sort_order)
+        r4 = TestCoordinateKey.DummyRecord("chr1", "1", 2)
+        self.assertFalse(checker._add_batch_compiled([self.r1, r4]))
+        r5 = TestCoordinateKey.DummyRecord("chr1", 1, 2**32)
+        self.assertFalse(checker._add_batch_compiled([self.r1, r5]))
+
+
 class TestSortOrderEnforcingIterator(unittest.TestCase):
     def test_empty_iter(self):
         so_iter = SortOrderEnforcingIterator(_iter=iter([]),
@@ -270,6 +603,21 @@ class TestSortOrderEnforcingIterator(unittest.TestCase):
         with self.assertRaises(ValueError):
             items = [item for item in so_iter]
 
+    def test_first_element_invalid(self):
+        sort_order = Coordinate(contigs=["chr1"])
+        for rec in [TestCoordinateKey.DummyRecord("no-chr", 1, 1),
+                    Coordinate()]:
+            so_iter = SortOrderEnforcingIterator(_iter=iter([rec]),
+                                                 sort_order=sort_order)
+            with self.assertRaises(ValueError):
+                next(so_iter)
+
+        # no key is built when the order cannot be sorted
+        rec = Coordinate()
+        so_iter = SortOrderEnforcingIterator(_iter=iter([rec]),
+                                             sort_order=Unsorted())
+        self.assertListEqual([item for item in so_iter], [rec])
+
     def test_unsorted(self):
         r1 = TestCoordinateKey.DummyRecord("C", 3, 4)
         r2 = TestCoordinateKey.DummyRecord("C", 2, 3)